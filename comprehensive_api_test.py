@@ -1,132 +1,144 @@
-import requests
+import asyncio
+import httpx
 import json
 import base64
 import tempfile
 import os
 from pathlib import Path
 
-def test_comprehensive_api():
-    """Test all API endpoints comprehensively."""
+async def _run_comprehensive_api():
+    """Test all API endpoints, firing independent checks concurrently."""
     base_url = "http://localhost:8000"
     username = "user"
     password = "testpassword123"
-    
+
     print("🔍 Starting comprehensive API testing...")
-    
-    # Test 1: Setup endpoint
-    print("\n1. Testing /api/setup endpoint...")
-    setup_data = {
-        "folder": str(Path.home() / "Documents"),  # Use user's Documents folder
-        "space": 0.1,  # 100MB
-        "password": password
-    }
-    
-    response = requests.post(f"{base_url}/api/setup", json=setup_data)
-    print(f"   Status: {response.status_code}")
-    
-    if response.status_code == 200:
-        setup_result = response.json()
-        print(f"   ✅ Setup successful! URL: {setup_result['url']}")
-    else:
-        print(f"   ❌ Setup failed: {response.text}")
-        return False
-    
-    # Test 2: Authentication for file listing
-    print("\n2. Testing /api/files endpoint with authentication...")
-    auth = (username, password)
-    
-    response = requests.get(f"{base_url}/api/files", auth=auth)
-    print(f"   Status: {response.status_code}")
-    
-    if response.status_code == 200:
-        files_result = response.json()
-        print(f"   ✅ File listing successful! Found {len(files_result['items'])} items")
-        print(f"   Storage usage: {files_result['storage']['percent']:.1f}%")
-        
-        # Display first few files
-        for i, item in enumerate(files_result['items'][:3]):
-            print(f"      - {item['name']} ({'folder' if item['is_dir'] else 'file'})")
-    else:
-        print(f"   ❌ File listing failed: {response.text}")
-        return False
-    
-    # Test 3: Test authentication failure
-    print("\n3. Testing authentication failure...")
-    bad_auth = (username, "wrongpassword")
-    response = requests.get(f"{base_url}/api/files", auth=bad_auth)
-    print(f"   Status: {response.status_code}")
-    
-    if response.status_code == 401:
-        print("   ✅ Authentication correctly rejected bad credentials")
-    else:
-        print(f"   ❌ Expected 401 but got {response.status_code}")
-    
-    # Test 4: File upload
-    print("\n4. Testing /api/upload endpoint...")
-    
-    # Create a test file
-    test_content = "This is a test file for API testing\nGenerated automatically"
-    test_filename = "api_test_file.txt"
-    
-    files = {'file': (test_filename, test_content, 'text/plain')}
-    response = requests.post(f"{base_url}/api/upload", files=files, auth=auth)
-    print(f"   Status: {response.status_code}")
-    
-    if response.status_code == 200:
-        upload_result = response.json()
-        print(f"   ✅ File upload successful: {upload_result['filename']}")
-    else:
-        print(f"   ❌ File upload failed: {response.text}")
-    
-    # Test 5: Download the uploaded file
-    print("\n5. Testing /api/download endpoint...")
-    
-    response = requests.get(f"{base_url}/api/download/{test_filename}", auth=auth)
-    print(f"   Status: {response.status_code}")
-    
-    if response.status_code == 200:
-        downloaded_content = response.text
-        if downloaded_content == test_content:
-            print("   ✅ File download successful and content matches")
+
+    # One client for the whole run so every request reuses a keep-alive connection
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        # Test 1: Setup endpoint
+        print("\n1. Testing /api/setup endpoint...")
+        setup_data = {
+            "folder": str(Path.home() / "Documents"),  # Use user's Documents folder
+            "space": 0.1,  # 100MB
+            "password": password
+        }
+
+        response = await client.post("/api/setup", json=setup_data)
+        print(f"   Status: {response.status_code}")
+
+        if response.status_code == 200:
+            setup_result = response.json()
+            print(f"   ✅ Setup successful! URL: {setup_result['url']}")
         else:
-            print("   ❌ Downloaded content doesn't match uploaded content")
-    else:
-        print(f"   ❌ File download failed: {response.text}")
-    
-    # Test 6: Preview endpoint
-    print("\n6. Testing /api/preview endpoint...")
-    
-    response = requests.get(f"{base_url}/api/preview/{test_filename}", auth=auth)
-    print(f"   Status: {response.status_code}")
-    
-    if response.status_code == 200:
-        print("   ✅ File preview successful")
-    else:
-        print(f"   ❌ File preview failed: {response.text}")
-    
-    # Test 7: Test invalid file paths (security)
-    print("\n7. Testing path traversal security...")
-    
-    malicious_paths = [
-        "../../../etc/passwd",
-        "..\\..\\..\\Windows\\System32\\config\\sam",
-        "%2e%2e%2f%2e%2e%2f%2e%2e%2fetc%2fpasswd"
-    ]
-    
-    security_passed = True
-    for malicious_path in malicious_paths:
-        response = requests.get(f"{base_url}/api/download/{malicious_path}", auth=auth)
+            print(f"   ❌ Setup failed: {response.text}")
+            return False
+
+        auth = (username, password)
+        bad_auth = (username, "wrongpassword")
+
+        # Tests 2 and 3 are independent, run them together
+        files_response, bad_auth_response = await asyncio.gather(
+            client.get("/api/files", auth=auth),
+            client.get("/api/files", auth=bad_auth),
+        )
+
+        # Test 2: Authentication for file listing
+        print("\n2. Testing /api/files endpoint with authentication...")
+        print(f"   Status: {files_response.status_code}")
+
+        if files_response.status_code == 200:
+            files_result = files_response.json()
+            print(f"   ✅ File listing successful! Found {len(files_result['items'])} items")
+            print(f"   Storage usage: {files_result['storage']['percent']:.1f}%")
+
+            # Display first few files
+            for i, item in enumerate(files_result['items'][:3]):
+                print(f"      - {item['name']} ({'folder' if item['is_dir'] else 'file'})")
+        else:
+            print(f"   ❌ File listing failed: {files_response.text}")
+            return False
+
+        # Test 3: Test authentication failure
+        print("\n3. Testing authentication failure...")
+        print(f"   Status: {bad_auth_response.status_code}")
+
+        if bad_auth_response.status_code == 401:
+            print("   ✅ Authentication correctly rejected bad credentials")
+        else:
+            print(f"   ❌ Expected 401 but got {bad_auth_response.status_code}")
+
+        # Test 4: File upload
+        print("\n4. Testing /api/upload endpoint...")
+
+        # Create a test file
+        test_content = "This is a test file for API testing\nGenerated automatically"
+        test_filename = "api_test_file.txt"
+
+        files = {'file': (test_filename, test_content, 'text/plain')}
+        response = await client.post("/api/upload", files=files, auth=auth)
+        print(f"   Status: {response.status_code}")
+
         if response.status_code == 200:
-            print(f"   ❌ Security vulnerability: {malicious_path} was accessible")
-            security_passed = False
+            upload_result = response.json()
+            print(f"   ✅ File upload successful: {upload_result['filename']}")
         else:
-            print(f"   ✅ Security check passed for: {malicious_path}")
-    
-    if security_passed:
-        print("   ✅ All security checks passed")
-    
+            print(f"   ❌ File upload failed: {response.text}")
+
+        # Tests 5-7 only read from the server, run them all together
+        malicious_paths = [
+            "../../../etc/passwd",
+            "..\\..\\..\\Windows\\System32\\config\\sam",
+            "%2e%2e%2f%2e%2e%2f%2e%2e%2fetc%2fpasswd"
+        ]
+        download_response, preview_response, *malicious_responses = await asyncio.gather(
+            client.get(f"/api/download/{test_filename}", auth=auth),
+            client.get(f"/api/preview/{test_filename}", auth=auth),
+            *(client.get(f"/api/download/{malicious_path}", auth=auth) for malicious_path in malicious_paths),
+        )
+
+        # Test 5: Download the uploaded file
+        print("\n5. Testing /api/download endpoint...")
+        print(f"   Status: {download_response.status_code}")
+
+        if download_response.status_code == 200:
+            downloaded_content = download_response.text
+            if downloaded_content == test_content:
+                print("   ✅ File download successful and content matches")
+            else:
+                print("   ❌ Downloaded content doesn't match uploaded content")
+        else:
+            print(f"   ❌ File download failed: {download_response.text}")
+
+        # Test 6: Preview endpoint
+        print("\n6. Testing /api/preview endpoint...")
+        print(f"   Status: {preview_response.status_code}")
+
+        if preview_response.status_code == 200:
+            print("   ✅ File preview successful")
+        else:
+            print(f"   ❌ File preview failed: {preview_response.text}")
+
+        # Test 7: Test invalid file paths (security)
+        print("\n7. Testing path traversal security...")
+
+        security_passed = True
+        for malicious_path, response in zip(malicious_paths, malicious_responses):
+            if response.status_code == 200:
+                print(f"   ❌ Security vulnerability: {malicious_path} was accessible")
+                security_passed = False
+            else:
+                print(f"   ✅ Security check passed for: {malicious_path}")
+
+        if security_passed:
+            print("   ✅ All security checks passed")
+
     print("\n🎉 Comprehensive API testing completed!")
     return True
 
+def test_comprehensive_api():
+    """Test all API endpoints comprehensively."""
+    return asyncio.run(_run_comprehensive_api())
+
 if __name__ == "__main__":
-    test_comprehensive_api()
\ No newline at end of file
+    test_comprehensive_api()
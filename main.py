@@ -1,36 +1,88 @@
+import asyncio
+import functools
 import os
+import hashlib
+import hmac
+import logging
+import secrets
 import shutil
-import tempfile
-import subprocess
 import threading
 import time
 import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from operator import itemgetter
 from pathlib import Path
+from stat import S_ISDIR, S_ISREG
 from typing import Optional
 
+import anyio
+import anyio.to_thread
+import bcrypt
 import pyAesCrypt
-import psutil
 from fastapi import FastAPI, HTTPException, UploadFile, File, Depends
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from passlib.context import CryptContext
-from starlette.status import HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED, HTTP_404_NOT_FOUND
+from starlette.datastructures import Headers
+from starlette.status import (HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED, HTTP_404_NOT_FOUND,
+                              HTTP_206_PARTIAL_CONTENT, HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+logger = logging.getLogger(__name__)
 
 # -------------------------------------------------------------
 # FastAPI initialisation
 # -------------------------------------------------------------
-app = FastAPI(title="Secure Folder Sharing API")
+# Worker threads for blocking file I/O. Each upload holds one for its whole copy,
+# so the defaults (min(32, cpu+4) for asyncio, 40 for anyio) let a few large
+# uploads stall listings, stats and password checks queued behind them.
+THREAD_POOL_SIZE = 64
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Size the thread pools on startup and stop LocalTunnel on shutdown."""
+    # asyncio.to_thread() runs on the loop's default executor; FileResponse and
+    # UploadFile go through anyio's limiter instead
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE, thread_name_prefix="io")
+    )
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREAD_POOL_SIZE
+    yield
+    await _stop_localtunnel()
+
+
+app = FastAPI(title="Secure Folder Sharing API", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Allow CORS so that the React app (typically on http://localhost:3000) can reach the API
 from fastapi.middleware.cors import CORSMiddleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["http://localhost:3000", "*"],  # adjust as needed
+    allow_origins=["http://localhost:3000"],  # the built SPA is served same-origin; add dev origins here
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"]
 )
 
+# Compress JSON listings only. GZipMiddleware compresses every content type,
+# so downloads/previews (often already-compressed media) bypass it.
+from fastapi.middleware.gzip import GZipMiddleware
+
+class _ListingGZipMiddleware:
+    def __init__(self, app, paths: tuple[str, ...] = ("/api/files",), **gzip_options):
+        self.app = app
+        self.gzip_app = GZipMiddleware(app, **gzip_options)
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.paths:
+            await self.gzip_app(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+# Level 1: listings are repetitive JSON, so the cheapest level already shrinks them several-fold
+app.add_middleware(_ListingGZipMiddleware, minimum_size=1024, compresslevel=1)
+
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 
@@ -43,15 +95,33 @@ if build_dir.exists():
 # Security helpers
 # -------------------------------------------------------------
 security = HTTPBasic()
-password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# bcrypt cost factor (2**rounds key-schedule iterations). The hash only lives
+# in memory and only wrong passwords are checked against it, so 10 (~4x cheaper
+# than bcrypt's default of 12) keeps failed logins and /setup responsive.
+BCRYPT_ROUNDS = 10
+
+# Per-process key for the request-time password check. It never leaves memory,
+# so the HMAC it produces is only useful to this server instance.
+_AUTH_SECRET = secrets.token_bytes(32)
+
+
+def _auth_tag(password: str) -> bytes:
+    """Return the keyed HMAC-SHA256 of *password* used for fast verification."""
+    return hmac.new(_AUTH_SECRET, password.encode(), hashlib.sha256).digest()
 
 # -------------------------------------------------------------
 # Runtime configuration (kept in-memory for simplicity)
 # -------------------------------------------------------------
 config: dict[str, Optional[object]] = {
     "folder_path": None,          # Path to reserved folder (Path)
+    "folder_prefix": None,        # str(folder_path) with one trailing separator (str)
     "reserved_bytes": None,       # Space reserved in bytes (int)
-    "password_hash": None,        # Bcrypt hash (str)
+    "used_bytes": None,           # Bytes currently stored in the folder (int)
+    "file_sizes": None,           # Size of every file in the folder, by path (dict)
+    "watcher": None,              # Filesystem observer keeping the two above current
+    "password_hash": None,        # Bcrypt hash (bytes)
+    "fast_auth": None,            # _auth_tag() of the password (bytes)
     "tunnel_process": None,       # LocalTunnel process
     "public_url": None            # Public URL for this server
 }
@@ -59,6 +129,26 @@ config: dict[str, Optional[object]] = {
 # BUFFER_SIZE retained for backward compatibility (no encryption now)
 BUFFER_SIZE = 64 * 1024
 
+# Chunk size used when streaming file bodies to / from disk
+CHUNK_SIZE = 1024 * 1024
+
+# Public URL printed by LocalTunnel once the tunnel is up (matched on raw output bytes)
+_LT_URL_RE = re.compile(rb'https://[a-zA-Z0-9-]+\.loca\.lt')
+# Most of LocalTunnel's stderr kept when it exits early (enough for the error message)
+_LT_STDERR_LIMIT = 64 * 1024
+
+# Name prefix of in-progress upload files (client file names may not use it)
+UPLOAD_PREFIX = ".upload-"
+
+# Guards used_bytes / file_sizes / _uploads_in_progress, which the filesystem
+# watcher reads and updates from its own thread
+_usage_lock = threading.Lock()
+
+# Temp files of uploads still being copied -> bytes charged to used_bytes so
+# far. upload_file accounts for these itself, so the watcher leaves exactly
+# these paths out of the index, and setup carries the charges over.
+_uploads_in_progress: dict[str, int] = {}
+
 # -------------------------------------------------------------
 # Utility functions
 # -------------------------------------------------------------
@@ -69,96 +159,414 @@ def _require_setup():
         raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Server not configured. Call /setup first.")
 
 
-def _verify_password(creds: HTTPBasicCredentials):
+async def _verify_password(creds: HTTPBasicCredentials):
     """Check provided HTTP Basic credentials against stored hash."""
-    if not password_context.verify(creds.password, config["password_hash"]):
+    # The correct password always matches the HMAC taken at setup, so bcrypt
+    # only runs for wrong guesses, which keep paying its full cost.
+    if hmac.compare_digest(_auth_tag(creds.password), config["fast_auth"]):
+        return
+    # bcrypt releases the GIL, so a worker thread keeps the event loop free
+    # and lets several checks use separate cores
+    if not await asyncio.to_thread(bcrypt.checkpw, creds.password.encode(), config["password_hash"]):
         raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="Invalid authentication credentials")
 
 
-def _folder_size(path: Path) -> int:
-    """Return total size of files under *path* in bytes."""
-    total = 0
-    for p in path.rglob('*'):
+# A single "bytes=start-end" range; multi-range requests get the whole file
+_BYTE_RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)', re.ASCII)
+
+
+def _parse_byte_range(value: str, size: int) -> Optional[tuple[int, int]]:
+    """Return the inclusive (start, end) requested by a Range header value.
+
+    None means the header should be ignored and the full file sent; a range
+    that cannot be satisfied raises ValueError.
+    """
+    match = _BYTE_RANGE_RE.fullmatch(value.strip())
+    if match is None or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the final N bytes
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError(value)
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError(value)
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+class _ChunkedFileResponse(FileResponse):
+    """FileResponse that streams in CHUNK_SIZE pieces rather than Starlette's 64 KiB.
+
+    It also answers single byte-range requests (Starlette 0.37 ignores Range),
+    so media previews can seek without downloading the file from the start.
+    """
+    chunk_size = CHUNK_SIZE
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.headers.setdefault("accept-ranges", "bytes")
+
+    async def __call__(self, scope, receive, send):
+        request_headers = Headers(scope=scope)
+        range_header = request_headers.get("range")
+        # A stale If-Range validator means the client's partial copy is outdated
+        if_range = request_headers.get("if-range")
+        if (range_header is None or self.stat_result is None
+                or (if_range is not None
+                    and if_range not in (self.headers["etag"], self.headers["last-modified"]))):
+            await super().__call__(scope, receive, send)
+            return
+
+        size = self.stat_result.st_size
         try:
-            if p.is_file():
-                total += p.stat().st_size
-        except FileNotFoundError:
-            # File might have been deleted between listing and stat
-            pass
-    return total
+            byte_range = _parse_byte_range(range_header, size)
+        except ValueError:
+            self.status_code = HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+            self.headers["content-range"] = f"bytes */{size}"
+            self.headers["content-length"] = "0"
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        if byte_range is None:
+            await super().__call__(scope, receive, send)
+            return
+
+        start, end = byte_range
+        self.status_code = HTTP_206_PARTIAL_CONTENT
+        self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        self.headers["content-length"] = str(end - start + 1)
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        else:
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await file.seek(start)
+                remaining = end - start + 1
+                while remaining:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        # File shrank since it was stat'ed
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": bool(remaining)})
+                if remaining:
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+        if self.background is not None:
+            await self.background()
+
+
+def _resolve_in_folder(rel_path: str) -> Optional[Path]:
+    """Resolve *rel_path* against the shared folder, or return None if it escapes it."""
+    # Null bytes make resolve() raise; reject them before touching the filesystem
+    if "\x00" in rel_path:
+        return None
+    folder_path: Path = config["folder_path"]
+    target_path = (folder_path / rel_path).resolve()
+    if target_path != folder_path and not str(target_path).startswith(config["folder_prefix"]):
+        return None
+    return target_path
+
+
+def _stat_in_folder(rel_path: str) -> tuple[Optional[Path], Optional[os.stat_result]]:
+    """Resolve *rel_path* inside the shared folder and stat it, as one blocking step.
+
+    Returns (None, None) if the path escapes the folder and (path, None) if it
+    cannot be stat'ed (missing, or a path through a regular file).
+    """
+    target_path = _resolve_in_folder(rel_path)
+    if target_path is None:
+        return None, None
+    try:
+        return target_path, os.stat(target_path)
+    except OSError:
+        return target_path, None
+
+
+def _iter_files(path: Path):
+    """Yield (path, size in bytes) for every file under *path*."""
+    # os.scandir avoids a Path object per entry and answers is_dir() from the
+    # directory listing itself; an explicit stack avoids recursion limits
+    stack = [str(path)]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            # Folder vanished or is unreadable
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    # Like rglob, do not descend into symlinked folders
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        yield entry.path, entry.stat().st_size
+                except OSError:
+                    # File might have been deleted between listing and stat
+                    pass
+
+
+def _track_path(path: str):
+    """Record the current size of *path* (or of every file under it) in the usage counter."""
+    if os.path.isdir(path):
+        found = list(_iter_files(Path(path)))
+    else:
+        try:
+            found = [(path, os.stat(path).st_size)]
+        except OSError:
+            # Already gone again; the matching delete event will settle it
+            return
+    with _usage_lock:
+        sizes = config["file_sizes"]
+        for file_path, size in found:
+            if file_path in _uploads_in_progress:
+                continue
+            config["used_bytes"] += size - sizes.get(file_path, 0)
+            sizes[file_path] = size
+
+
+def _untrack_path(path: str):
+    """Remove *path* (or every file under it) from the usage counter."""
+    with _usage_lock:
+        if path in _uploads_in_progress:
+            return
+        sizes = config["file_sizes"]
+        removed = sizes.pop(path, None)
+        if removed is None:
+            # Not a known file, so possibly a folder: drop everything below it
+            prefix = path.rstrip(os.sep) + os.sep
+            removed = sum(sizes.pop(p) for p in [p for p in sizes if p.startswith(prefix)])
+        config["used_bytes"] -= removed
+
+
+def _remove_stale_uploads(folder_path: Path):
+    """Delete temp files left in *folder_path* by uploads that never finished."""
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if not (entry.name.startswith(UPLOAD_PREFIX) and entry.name.endswith(".part")):
+                continue
+            with _usage_lock:
+                if entry.path in _uploads_in_progress:
+                    continue
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+
+
+def _copy_upload(source, dest, reserved: int) -> int:
+    """Copy *source* into the registered upload file *dest*, charging each chunk to used_bytes.
+
+    Charging before writing lets concurrent uploads see each other's progress,
+    so the quota check never has to rescan the folder. The charge is recorded
+    under dest's entry in _uploads_in_progress, and upload_file releases it.
+    """
+    # One reusable buffer instead of a new bytes object per chunk
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    while n := source.readinto(buffer):
+        with _usage_lock:
+            if config["used_bytes"] + n > reserved:
+                raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
+                                    detail="Uploading this file would exceed reserved space")
+            config["used_bytes"] += n
+            _uploads_in_progress[dest.name] += n
+        dest.write(view[:n])
+
+
+def _replace_upload(tmp_path: Path, dest_path: Path) -> int:
+    """Move a finished upload into place and return its size on disk."""
+    # The temp file lives in the same folder, so this is atomic and never copies the data
+    os.replace(tmp_path, dest_path)
+    return os.stat(dest_path).st_size
+
+
+class _UsageWatcher(FileSystemEventHandler):
+    """Keep the usage counter in step with changes made outside the API."""
 
+    def on_created(self, event):
+        _track_path(event.src_path)
 
-def _start_localtunnel(port: int = 8000, subdomain: str = None) -> tuple[subprocess.Popen, str]:
+    def on_modified(self, event):
+        if not event.is_directory:
+            _track_path(event.src_path)
+
+    def on_deleted(self, event):
+        _untrack_path(event.src_path)
+
+    def on_moved(self, event):
+        _untrack_path(event.src_path)
+        _track_path(event.dest_path)
+
+
+def _start_watcher(folder_path: Path):
+    """Watch *folder_path* so used_bytes stays accurate without rescanning."""
+    observer = Observer()
+    observer.schedule(_UsageWatcher(), str(folder_path), recursive=True)
+    try:
+        observer.start()
+    except OSError as e:
+        # e.g. inotify watch limit reached; uploads still keep the counter current
+        logger.warning("Could not watch %s for changes: %s", folder_path, e)
+        return
+    config["watcher"] = observer
+
+
+def _stop_watcher():
+    """Stop the current filesystem observer."""
+    if config["watcher"]:
+        config["watcher"].stop()
+        config["watcher"].join(timeout=5)
+        config["watcher"] = None
+
+
+# Preview type by lower-cased extension. ".ogg" stays "video" as before
+# (it was checked against the video list first); a <video> element plays audio-only Ogg too.
+_EXT_TYPE = {
+    **dict.fromkeys(['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'], "image"),
+    **dict.fromkeys(['.mp4', '.webm', '.ogg', '.mov'], "video"),
+    **dict.fromkeys(['.mp3', '.wav', '.flac'], "audio"),
+    '.pdf': "pdf",
+    **dict.fromkeys(['.txt', '.md', '.csv', '.json', '.xml', '.html', '.css', '.js'], "text"),
+}
+
+
+def _list_directory(current_dir: Path, folder_path: Path) -> list[dict]:
+    """Return metadata for the entries of *current_dir*, paths relative to *folder_path*.
+
+    Folders come first, then files, each sorted by name.
+    """
+    # Compute the relative prefix once instead of calling relative_to() per entry
+    prefix = "" if current_dir == folder_path else str(current_dir.relative_to(folder_path)) + os.sep
+    dirs = []
+    files = []
+    with os.scandir(current_dir) as entries:
+        for item in entries:
+            if item.name.startswith(UPLOAD_PREFIX):
+                # In-progress (or abandoned) upload, not part of the share
+                continue
+            try:
+                # Classify from the same stat result instead of a second lookup
+                stat = item.stat()
+                is_dir = S_ISDIR(stat.st_mode)
+                
+                # Determine file type for preview capability
+                if is_dir:
+                    file_type = "folder"
+                else:
+                    file_type = _EXT_TYPE.get(os.path.splitext(item.name)[1].lower(), "unknown")
+                
+                (dirs if is_dir else files).append({
+                    "name": item.name,
+                    "path": prefix + item.name,
+                    "is_dir": is_dir,
+                    "size": stat.st_size if not is_dir else 0,
+                    "modified": stat.st_mtime,
+                    "type": file_type
+                })
+            except Exception as e:
+                # Skip files with access issues
+                continue
+    
+    # Partitioned while scanning, so each half sorts on the name alone
+    by_name = itemgetter("name")
+    dirs.sort(key=by_name)
+    files.sort(key=by_name)
+    return dirs + files
+
+
+@functools.lru_cache(maxsize=1)
+def _resolve_lt_cmd() -> Optional[tuple[bool, str]]:
+    """Locate lt.cmd (or npx.cmd) next to npm; resolved once per process."""
+    npm_path = shutil.which('npm')
+    if not npm_path:
+        return None
+    npm_dir = os.path.dirname(npm_path)
+    
+    # Prefer lt directly, use npx as fallback
+    for name in ('lt.cmd', 'npx.cmd'):
+        path = os.path.join(npm_dir, name)
+        if os.path.exists(path):
+            return name.startswith('lt'), path
+    return None
+
+
+async def _start_localtunnel(port: int = 8000, subdomain: str = None) -> tuple[asyncio.subprocess.Process, str]:
     """Start LocalTunnel and return process and public URL."""
     try:
-        # Find npm path to locate npx
-        npm_path = subprocess.check_output(['where', 'npm'], text=True).strip().split('\n')[0]
-        npm_dir = os.path.dirname(npm_path)
-        
-        # Look for lt in the same directory as npm
-        lt_path = os.path.join(npm_dir, 'lt.cmd')
-        
-        if os.path.exists(lt_path):
-            # Use lt directly if available
-            if subdomain:
-                cmd = [lt_path, '--port', str(port), '--subdomain', subdomain]
-            else:
-                cmd = [lt_path, '--port', str(port)]
+        resolved = _resolve_lt_cmd()
+        if resolved is None:
+            # Last resort - try generic command
+            cmd = ['npx', 'localtunnel']
         else:
-            # Use npx as fallback
-            npx_path = os.path.join(npm_dir, 'npx.cmd')
-            if os.path.exists(npx_path):
-                if subdomain:
-                    cmd = [npx_path, 'localtunnel', '--port', str(port), '--subdomain', subdomain]
-                else:
-                    cmd = [npx_path, 'localtunnel', '--port', str(port)]
-            else:
-                # Last resort - try generic commands
-                if subdomain:
-                    cmd = ['npx', 'localtunnel', '--port', str(port), '--subdomain', subdomain]
-                else:
-                    cmd = ['npx', 'localtunnel', '--port', str(port)]
+            is_lt, cmd_path = resolved
+            cmd = [cmd_path] if is_lt else [cmd_path, 'localtunnel']
+        cmd += ['--port', str(port)]
+        if subdomain:
+            cmd += ['--subdomain', subdomain]
         
-        # Start the process
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,
-            universal_newlines=True
+        # Start the process; its output is awaited, so the event loop keeps
+        # serving other requests while LocalTunnel connects
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
         )
         
-        # Wait for URL to appear in output
-        url = None
-        start_time = time.time()
-        while time.time() - start_time < 30:  # 30 second timeout
-            if process.poll() is not None:
-                # Process ended, check for errors
-                stderr = process.stderr.read()
-                if "subdomain already requested" in stderr and subdomain:
-                    # Try without subdomain
-                    process.terminate()
-                    return _start_localtunnel(port, None)
-                raise Exception(f"LocalTunnel failed: {stderr}")
+        try:
+            # Wait for URL to appear in output
+            url = None
+            deadline = time.monotonic() + 30  # 30 second timeout
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    line = await asyncio.wait_for(process.stdout.readline(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
             
-            # Check if we have output
-            try:
-                line = process.stdout.readline()
-                if line:
-                    # Look for URL pattern
-                    url_match = re.search(r'https://[a-zA-Z0-9-]+\.loca\.lt', line)
-                    if url_match:
-                        url = url_match.group(0)
-                        break
-            except:
-                continue
+                if not line:
+                    # Output closed, so the process is ending; check for errors.
+                    # Only the start of stderr matters and a wedged process must not
+                    # hang setup, so both the read and the wait are bounded.
+                    try:
+                        stderr = await asyncio.wait_for(process.stderr.read(_LT_STDERR_LIMIT), timeout=2)
+                    except asyncio.TimeoutError:
+                        stderr = b""
+                    stderr = stderr.decode(errors="replace")
+                    try:
+                        await asyncio.wait_for(process.wait(), timeout=2)
+                    except asyncio.TimeoutError:
+                        # Still running, or a child still holds the pipes open; the
+                        # event loop reaps it once it exits
+                        try:
+                            process.kill()
+                        except ProcessLookupError:
+                            pass
+                    if "subdomain already requested" in stderr and subdomain:
+                        # Try without subdomain
+                        return await _start_localtunnel(port, None)
+                    raise Exception(f"LocalTunnel failed: {stderr}")
             
-            time.sleep(0.5)
+                # Look for URL pattern
+                url_match = _LT_URL_RE.search(line)
+                if url_match:
+                    url = url_match.group(0).decode()
+                    break
         
-        if not url:
-            process.terminate()
-            raise Exception("Failed to get LocalTunnel URL")
+            if not url:
+                raise Exception("Failed to get LocalTunnel URL")
+        except BaseException:
+            # Whatever went wrong (timeout, a line over the StreamReader limit,
+            # cancellation), never leave an untracked LocalTunnel running
+            try:
+                process.terminate()
+            except ProcessLookupError:
+                pass
+            raise
         
         return process, url
         
@@ -168,12 +576,12 @@ def _start_localtunnel(port: int = 8000, subdomain: str = None) -> tuple[subproc
         raise Exception(f"Failed to start LocalTunnel: {str(e)}")
 
 
-def _stop_localtunnel():
+async def _stop_localtunnel():
     """Stop the current LocalTunnel process."""
     if config["tunnel_process"]:
         try:
             config["tunnel_process"].terminate()
-            config["tunnel_process"].wait(timeout=5)
+            await asyncio.wait_for(config["tunnel_process"].wait(), timeout=5)
         except:
             try:
                 config["tunnel_process"].kill()
@@ -185,13 +593,20 @@ def _stop_localtunnel():
 # -------------------------------------------------------------
 # API MODELS
 # -------------------------------------------------------------
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 
 class SetupRequest(BaseModel):
-    folder: str = Field(..., description="Folder path to create / use")
+    folder: Path = Field(..., description="Existing folder to share")
     space: float = Field(..., gt=0, description="Reserved space in GB")
     password: str = Field(..., min_length=4, description="Password for encryption & auth")
 
+    @field_validator("folder")
+    @classmethod
+    def _normalise_folder(cls, folder: Path) -> Path:
+        """Undo escaped backslashes; filesystem checks happen in setup, off the event loop."""
+        # Windows paths sometimes arrive with their backslashes still escaped
+        return Path(str(folder).replace('\\\\', '\\'))
+
 class SetupResponse(BaseModel):
     url: str
 
@@ -199,133 +614,65 @@ class SetupResponse(BaseModel):
 # ENDPOINTS
 # -------------------------------------------------------------
 
+def _check_folder(folder: Path) -> Path:
+    """Resolve *folder* and make sure it is a readable directory; return the resolved path."""
+    try:
+        folder = folder.expanduser().resolve()
+        is_dir = S_ISDIR(folder.stat().st_mode)
+        if is_dir:
+            # Reading a single entry is enough to prove the folder can be listed
+            with os.scandir(folder) as entries:
+                next(entries, None)
+    except FileNotFoundError:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
+                            detail=f"Folder does not exist: {folder}")
+    except PermissionError:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
+                            detail=f"Permission denied: Cannot read folder: {folder}")
+    except (OSError, RuntimeError, ValueError) as e:
+        # RuntimeError: symlink loop; ValueError: e.g. an embedded NUL byte
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
+                            detail=f"Invalid folder path: {str(e)}")
+    if not is_dir:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
+                            detail=f"Path is not a directory: {folder}")
+    return folder
+
+
 @app.post("/api/setup", response_model=SetupResponse)
-def setup(req: SetupRequest):
+async def setup(req: SetupRequest):
     """Initialise the server with folder, reserved space and password."""
-    try:
-        print(f"Setup request received: folder={req.folder}, space={req.space}GB")
-        
-        # Handle path normalization for Windows paths
-        folder_str = req.folder
-        if '\\\\' in folder_str:
-            # Convert double backslashes to single for Path
-            folder_str = folder_str.replace('\\\\', '\\')
-        
-        print(f"Normalized folder path: {folder_str}")
-        
-        try:
-            folder_path = Path(folder_str).expanduser().resolve()
-            print(f"Resolved folder path: {folder_path}")
-        except Exception as e:
-            print(f"Error resolving path: {e}")
-            raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
-                                detail=f"Invalid folder path: {str(e)}")
-        
-        # Check if path exists before trying to access it
-        try:
-            exists = folder_path.exists()
-            is_dir = folder_path.is_dir() if exists else False
-            print(f"Path exists: {exists}, is directory: {is_dir}")
-        except PermissionError:
-            print(f"Permission error accessing path: {folder_path}")
-            raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
-                                detail="Permission denied: Cannot access the specified folder")
-        except Exception as e:
-            print(f"Error checking path: {e}")
-            raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
-                                detail=f"Error accessing folder: {str(e)}")
-        
-        if not exists:
-            print(f"Error: Folder does not exist: {folder_path}")
-            raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
-                                detail=f"Folder does not exist: {folder_path}")
-        
-        if not is_dir:
-            print(f"Error: Path is not a directory: {folder_path}")
-            raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
-                                detail=f"Path is not a directory: {folder_path}")
-        
-        # Check if we have read permissions (we don't need write permissions for sharing)
-        try:
-            # Just list the directory to check if we can read it
-            try:
-                # Try to list directory contents
-                contents = list(folder_path.iterdir())
-                print(f"Successfully read directory contents: {folder_path}, found {len(contents)} items")
-            except PermissionError:
-                print(f"Permission error: Cannot read folder: {folder_path}")
-                raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
-                                    detail="Permission denied: Cannot read the specified folder")
-            except Exception as e:
-                print(f"Error reading directory: {e}")
-                raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
-                                    detail=f"Cannot read folder: {str(e)}")
-                                    
-            # Check if we have write permissions (optional, just for logging)
-            try:
-                # Use access() to check write permissions without actually writing
-                import os
-                if os.access(str(folder_path), os.W_OK):
-                    print(f"Folder is writable: {folder_path}")
-                else:
-                    print(f"Folder is read-only: {folder_path}")
-                    # We'll still allow read-only folders to be shared
-            except Exception as e:
-                print(f"Error checking write permissions: {e}")
-                # Continue anyway, we don't need write permissions
-        except Exception as e:
-            if isinstance(e, HTTPException):
-                raise
-            print(f"Unexpected error checking folder permissions: {e}")
-            import traceback
-            traceback.print_exc()
-            raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
-                                detail=f"Error accessing folder: {str(e)}")
-        
-        reserved_bytes = int(req.space * (1024 ** 3))  # convert GB → bytes
-        print(f"Reserved bytes: {reserved_bytes}")
+    # Folder and disk checks, hashing and indexing are blocking (and the folder
+    # may be on a slow network share), so they run in worker threads; waiting
+    # for LocalTunnel only awaits its output
+    folder_path = await asyncio.to_thread(_check_folder, req.folder)
+    reserved_bytes = int(req.space * (1024 ** 3))  # convert GB → bytes
+    logger.debug("Setup request: folder=%s, reserved=%d bytes", folder_path, reserved_bytes)
 
-        # Check disk free space
-        try:
-            disk = psutil.disk_usage(str(folder_path.drive) if folder_path.drive else str(folder_path))
-            print(f"Disk space: free={disk.free}, total={disk.total}")
-            
-            if reserved_bytes > disk.free:
-                print(f"Error: Insufficient disk space. Requested: {reserved_bytes}, Available: {disk.free}")
-                raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
-                                    detail=f"Insufficient disk space. Requested: {reserved_bytes/1024**3:.1f}GB, Available: {disk.free/1024**3:.1f}GB")
-        except Exception as e:
-            if isinstance(e, HTTPException):
-                raise e
-            print(f"Error checking disk space: {e}")
-            raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
-                                detail=f"Error checking disk space: {str(e)}")
-    
-    except HTTPException:
-        # Re-raise HTTP exceptions
-        raise
-    except Exception as e:
-        # Catch any other exceptions
-        print(f"Unexpected error in setup: {e}")
-        import traceback
-        traceback.print_exc()
+    try:
+        disk = await asyncio.to_thread(shutil.disk_usage, folder_path)
+    except OSError as e:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
+                            detail=f"Error checking disk space: {str(e)}")
+    if reserved_bytes > disk.free:
         raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
-                            detail=f"Error setting up folder share: {str(e)}")
+                            detail=f"Insufficient disk space. Requested: {reserved_bytes/1024**3:.1f}GB, Available: {disk.free/1024**3:.1f}GB")
 
     # Store hashed password
-    password_hash = password_context.hash(req.password)
+    password_hash = await asyncio.to_thread(bcrypt.hashpw, req.password.encode(),
+                                            bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
 
     # Start LocalTunnel if not already running
-    if config["tunnel_process"] is None or config["tunnel_process"].poll() is not None:
+    if config["tunnel_process"] is None or config["tunnel_process"].returncode is not None:
         try:
             # Stop any existing tunnel
-            _stop_localtunnel()
+            await _stop_localtunnel()
             
             # Generate a subdomain based on folder name for consistency
             folder_name = folder_path.name.lower().replace(' ', '-').replace('_', '-')
             subdomain = f"share-{folder_name}"[:20]  # Keep it short
             
-            process, public_url = _start_localtunnel(8000, subdomain)
+            process, public_url = await _start_localtunnel(8000, subdomain)
             config.update({
                 "tunnel_process": process,
                 "public_url": public_url
@@ -341,12 +688,31 @@ def setup(req: SetupRequest):
     
     public_url = config["public_url"]
 
+    # Index the folder once; from here on uploads and the watcher keep it current
+    await asyncio.to_thread(_stop_watcher)
+    await asyncio.to_thread(_remove_stale_uploads, folder_path)
+    file_sizes = await asyncio.to_thread(dict, _iter_files(folder_path))
+    with _usage_lock:
+        # Same rule as the watcher: only uploads still being copied are left out,
+        # and their running charges carry over, since each upload releases its
+        # charge from whichever counter is current when it finishes
+        for tmp_name in _uploads_in_progress:
+            file_sizes.pop(tmp_name, None)
+        config.update({
+            "used_bytes": sum(file_sizes.values()) + sum(_uploads_in_progress.values()),
+            "file_sizes": file_sizes,
+        })
+
     # Save config
     config.update({
         "folder_path": folder_path,
+        # The trailing separator keeps "/share" from admitting "/share_evil"
+        "folder_prefix": str(folder_path).rstrip(os.sep) + os.sep,
         "reserved_bytes": reserved_bytes,
         "password_hash": password_hash,
+        "fast_auth": _auth_tag(req.password),
     })
+    await asyncio.to_thread(_start_watcher, folder_path)
 
     return {"url": public_url}
 
@@ -358,28 +724,47 @@ async def upload_file(
 ):
     """Upload a file into the shared folder, enforcing reserved space (no encryption)."""
     _require_setup()
-    _verify_password(creds)
+    await _verify_password(creds)
 
     folder_path: Path = config["folder_path"]
     reserved: int = config["reserved_bytes"]
 
-    # Determine size of uploaded file
-    file_bytes = await file.read()
-    new_file_size = len(file_bytes)
-
-    current_size = _folder_size(folder_path)
-    if current_size + new_file_size > reserved:
-        raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
-                            detail="Uploading this file would exceed reserved space")
-
-    # Save to a temporary file first
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        tmp.write(file_bytes)
-        tmp_path = Path(tmp.name)
-
-    # Move the uploaded file into the destination folder
-    dest_path = folder_path / file.filename
-    shutil.move(str(tmp_path), dest_path)
+    # Only the final name component is used, so the upload cannot escape the folder
+    filename = os.path.basename(file.filename or "")
+    # The temp-file prefix is reserved so a client name never collides with a live upload
+    if filename in ("", ".", "..") or "\x00" in filename or filename.startswith(UPLOAD_PREFIX):
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Invalid file name")
+    dest_path = folder_path / filename
+
+    # SpooledTemporaryFile only gained readinto() in Python 3.11; use the file it wraps
+    source = getattr(file.file, "_file", file.file)
+
+    # Stream into a temporary file inside the shared folder, off the event loop.
+    # The name is registered before the file exists, so neither the watcher nor
+    # setup's stale-upload cleanup can ever mistake it for a leftover.
+    tmp_path = folder_path / f"{UPLOAD_PREFIX}{secrets.token_hex(8)}.part"
+    tmp_name = str(tmp_path)
+    with _usage_lock:
+        _uploads_in_progress[tmp_name] = 0
+    final_size = None
+    try:
+        with open(tmp_path, "xb") as tmp:
+            await asyncio.to_thread(_copy_upload, source, tmp, reserved)
+        final_size = await asyncio.to_thread(_replace_upload, tmp_path, dest_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    finally:
+        # Swap the running charge for the file's entry in the index (which also
+        # accounts for any file this upload replaced) in one step, so a
+        # concurrent upload never checks the quota against a short counter
+        with _usage_lock:
+            config["used_bytes"] -= _uploads_in_progress.pop(tmp_name)
+            if final_size is not None:
+                dest_name = str(dest_path)
+                sizes = config["file_sizes"]
+                config["used_bytes"] += final_size - sizes.get(dest_name, 0)
+                sizes[dest_name] = final_size
     return {"message": "File uploaded", "filename": dest_path.name}
 
 
@@ -387,55 +772,24 @@ async def upload_file(
 async def list_files(creds: HTTPBasicCredentials = Depends(security), path: str = ""):
     """Return list of available files and folders in the reserved folder."""
     _require_setup()
-    _verify_password(creds)
+    await _verify_password(creds)
 
     folder_path: Path = config["folder_path"]
     
     # Handle subdirectory navigation
     if path:
-        # Ensure path doesn't escape the reserved folder
-        target_path = (folder_path / path).resolve()
-        if not str(target_path).startswith(str(folder_path)):
+        # Ensure path doesn't escape the reserved folder (resolve + stat off the event loop)
+        target_path, stat_result = await asyncio.to_thread(_stat_in_folder, path)
+        if target_path is None:
             raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Invalid path")
-        if not target_path.exists() or not target_path.is_dir():
+        if stat_result is None or not S_ISDIR(stat_result.st_mode):
             raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Directory not found")
         current_dir = target_path
     else:
         current_dir = folder_path
     
-    # Get files and folders with metadata
-    items = []
-    for item in current_dir.iterdir():
-        try:
-            stat = item.stat()
-            is_dir = item.is_dir()
-            
-            # Determine file type for preview capability
-            file_type = "folder" if is_dir else "unknown"
-            if not is_dir:
-                ext = item.suffix.lower()
-                if ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']:
-                    file_type = "image"
-                elif ext in ['.mp4', '.webm', '.ogg', '.mov']:
-                    file_type = "video"
-                elif ext in ['.mp3', '.wav', '.ogg', '.flac']:
-                    file_type = "audio"
-                elif ext in ['.pdf']:
-                    file_type = "pdf"
-                elif ext in ['.txt', '.md', '.csv', '.json', '.xml', '.html', '.css', '.js']:
-                    file_type = "text"
-            
-            items.append({
-                "name": item.name,
-                "path": str(item.relative_to(folder_path)),
-                "is_dir": is_dir,
-                "size": stat.st_size if not is_dir else 0,
-                "modified": stat.st_mtime,
-                "type": file_type
-            })
-        except Exception as e:
-            # Skip files with access issues
-            continue
+    # Get files and folders with metadata (blocking I/O, run in a worker thread)
+    items = await asyncio.to_thread(_list_directory, current_dir, folder_path)
     
     # Calculate current path for breadcrumb navigation
     breadcrumbs = []
@@ -446,13 +800,13 @@ async def list_files(creds: HTTPBasicCredentials = Depends(security), path: str
             current = str(Path(current) / part)
             breadcrumbs.append({"name": part, "path": current})
     
-    # Calculate storage usage
-    total_size = _folder_size(folder_path)
+    # Storage usage comes from the live counter rather than walking the folder
+    total_size = config["used_bytes"]
     reserved_bytes = config["reserved_bytes"]
     usage_percent = (total_size / reserved_bytes) * 100 if reserved_bytes > 0 else 0
     
     return {
-        "items": sorted(items, key=lambda x: (not x["is_dir"], x["name"])),  # Folders first
+        "items": items,  # Folders first, already sorted by _list_directory
         "current_path": path,
         "breadcrumbs": breadcrumbs,
         "storage": {
@@ -463,6 +817,28 @@ async def list_files(creds: HTTPBasicCredentials = Depends(security), path: str
     }
 
 
+async def _serve_file(file_path: str, inline: bool) -> _ChunkedFileResponse:
+    """Resolve *file_path* inside the shared folder and stream it back."""
+    # Security check and a single stat, both off the event loop; the stat serves
+    # both the existence check and FileResponse's headers
+    target_path, stat_result = await asyncio.to_thread(_stat_in_folder, file_path)
+    if target_path is None:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Invalid file path")
+    # Missing, not a regular file, or a half-written upload (hidden from
+    # listings, so not servable either); never echo the server-side path back
+    if (stat_result is None or not S_ISREG(stat_result.st_mode)
+            or target_path.name.startswith(UPLOAD_PREFIX)):
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="File not found")
+
+    # Inline lets the browser display the content instead of saving it
+    return _ChunkedFileResponse(
+        target_path,
+        filename=target_path.name,
+        stat_result=stat_result,
+        content_disposition_type="inline" if inline else "attachment"
+    )
+
+
 @app.get("/api/download/{file_path:path}")
 async def download_file(
     file_path: str,
@@ -470,56 +846,38 @@ async def download_file(
 ):
     """Return the requested file if auth is valid (no decryption)."""
     _require_setup()
-    _verify_password(creds)
+    await _verify_password(creds)
+    return await _serve_file(file_path, inline=False)
 
-    folder_path: Path = config["folder_path"]
-    target_path = (folder_path / file_path).resolve()
-    
-    # Security check: ensure the path is within the shared folder
-    if not str(target_path).startswith(str(folder_path)):
-        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Invalid file path")
-    
-    if not target_path.exists() or not target_path.is_file():
-        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="File not found")
-
-    return FileResponse(target_path, filename=target_path.name)
 
-
-@app.get("/api/preview/{file_path:path}")
+# HEAD lets media players learn the size and range support without a body
+@app.api_route("/api/preview/{file_path:path}", methods=["GET", "HEAD"])
 async def preview_file(
     file_path: str,
     creds: HTTPBasicCredentials = Depends(security)
 ):
     """Return the file for preview with appropriate content headers."""
     _require_setup()
-    _verify_password(creds)
-
-    folder_path: Path = config["folder_path"]
-    target_path = (folder_path / file_path).resolve()
-    
-    # Security check: ensure the path is within the shared folder
-    if not str(target_path).startswith(str(folder_path)):
-        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Invalid file path")
-    
-    if not target_path.exists() or not target_path.is_file():
-        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="File not found")
-    
-    # For preview, we don't set the content-disposition header to attachment
-    # This allows the browser to display the content inline
-    return FileResponse(
-        target_path,
-        filename=target_path.name,
-        content_disposition_type="inline"
-    )
+    await _verify_password(creds)
+    response = await _serve_file(file_path, inline=True)
+    # Seeking re-requests ranges of the same file; let the browser reuse them briefly
+    response.headers["cache-control"] = "private, max-age=300"
+    return response
 
 
 # -------------------------------------------------------------
 # SPA fallback (serve React index.html for any other route)
+# index.html only changes on a rebuild (which needs a restart anyway), so stat it once
+_INDEX_FILE = build_dir / "index.html"
+try:
+    _INDEX_STAT = os.stat(_INDEX_FILE)
+except OSError:
+    _INDEX_STAT = None
+
 @app.get("/{rest_of_path:path}", include_in_schema=False)
 async def serve_spa(rest_of_path: str):
-    index_file = build_dir / "index.html"
-    if index_file.exists():
-        return FileResponse(index_file)
+    if _INDEX_STAT is not None:
+        return FileResponse(_INDEX_FILE, stat_result=_INDEX_STAT)
     raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Not Found")
 
 # -------------------------------------------------------------
@@ -529,7 +887,14 @@ import atexit
 
 def cleanup():
     """Clean up resources on app shutdown."""
-    _stop_localtunnel()
+    _stop_watcher()
+    # Normally already stopped by the lifespan handler; this covers abrupt exits
+    process = config["tunnel_process"]
+    if process is not None and process.returncode is None:
+        try:
+            process.terminate()
+        except ProcessLookupError:
+            pass
 
 atexit.register(cleanup)
 
@@ -539,7 +904,6 @@ atexit.register(cleanup)
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
     """Handle all exceptions and return JSON instead of HTML error pages."""
-    from fastapi.responses import JSONResponse
     
     status_code = 500
     if isinstance(exc, HTTPException):
@@ -551,7 +915,7 @@ async def global_exception_handler(request, exc):
     traceback.print_exc()
     
     # Return JSON response
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status_code,
         content={"detail": str(exc)}
     )
@@ -579,7 +943,11 @@ if __name__ == "__main__":
             else:
                 try:
                     print(f"Starting server on port {port}...")
-                    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=False)
+                    # The share settings, usage counter and tunnel live in this
+                    # process's memory, so the server must stay a single worker.
+                    # uvicorn[standard] already picks uvloop and httptools when
+                    # they are installed.
+                    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=False, workers=1)
                     break
                 except Exception as e:
                     print(f"Failed to start server on port {port}: {e}")
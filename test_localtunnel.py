@@ -3,25 +3,29 @@ import time
 import re
 import sys
 import os
+import shutil
+
+# Public URL printed by LocalTunnel once the tunnel is up
+LT_URL_RE = re.compile(r'https://[a-zA-Z0-9-]+\.loca\.lt')
 
 def test_localtunnel():
     print("Testing LocalTunnel connection...")
     
     # Try to start LocalTunnel
     try:
-        # Check for npm path
-        npm_path = subprocess.check_output(['where', 'npm'], text=True).strip().split('\n')[0]
-        npm_dir = os.path.dirname(npm_path)
+        # Check for npm path (PATH lookup in-process, no `where` subprocess)
+        npm_path = shutil.which('npm')
+        npm_dir = os.path.dirname(npm_path) if npm_path else None
         
         # Look for lt in the same directory as npm
-        lt_path = os.path.join(npm_dir, 'lt.cmd')
+        lt_path = os.path.join(npm_dir, 'lt.cmd') if npm_dir else None
         
-        if os.path.exists(lt_path):
+        if lt_path and os.path.exists(lt_path):
             cmd = [lt_path, '--port', '8000', '--subdomain', 'test-connection']
         else:
             # Try with npx
-            npx_path = os.path.join(npm_dir, 'npx.cmd')
-            if os.path.exists(npx_path):
+            npx_path = os.path.join(npm_dir, 'npx.cmd') if npm_dir else None
+            if npx_path and os.path.exists(npx_path):
                 cmd = [npx_path, 'localtunnel', '--port', '8000', '--subdomain', 'test-connection']
             else:
                 # Last resort
@@ -57,7 +61,7 @@ def test_localtunnel():
             if line:
                 print(f"Output: {line.strip()}")
                 # Look for URL pattern
-                url_match = re.search(r'https://[a-zA-Z0-9-]+\.loca\.lt', line)
+                url_match = LT_URL_RE.search(line)
                 if url_match:
                     url = url_match.group(0)
                     print(f"Found URL: {url}")